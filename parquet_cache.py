@@ -0,0 +1,62 @@
+"""Leitura dos arquivos de data/ com cópias em Parquet ao lado dos originais.
+
+Na primeira leitura (ou quando o original for mais novo) o arquivo é lido do
+formato original e gravado em Parquet; daí em diante só o Parquet é lido.
+"""
+import pandas as pd
+
+# Únicas colunas da planilha de abandono usadas pelo aplicativo
+COLUNAS_ABANDONO = ["cod_mun", "Ano", "UF", "Região", "Total Abandono no Ens. Médio"]
+
+# Colunas do cadastro de municípios usadas, com os tipos já na leitura
+TIPOS_MUNICIPIOS = {"cod_mun": "int32", "municipio": "str", "longitude": "float32", "latitude": "float32"}
+
+
+def _parquet_atualizado(origem, parquet):
+    return parquet.exists() and parquet.stat().st_mtime >= origem.stat().st_mtime
+
+
+def _engine_excel():
+    # python-calamine (Rust) lê a planilha cerca de 9x mais rápido que o openpyxl
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return None
+    return "calamine"
+
+
+def _gravar_parquet(df, parquet):
+    # Em ambientes só de leitura o aplicativo segue usando o arquivo original
+    try:
+        df.to_parquet(parquet, compression="zstd", index=False)
+    except OSError:
+        pass
+
+
+def read_abandono(xlsx_path, parquet_path):
+    """Lê a planilha de abandono com a taxa já convertida para número"""
+    if _parquet_atualizado(xlsx_path, parquet_path):
+        return pd.read_parquet(parquet_path, columns=["cod_mun", "Ano", "UF", "Região", "taxa"])
+
+    # "--" indica ausência de dado e textos com vírgula decimal são convertidos
+    # já na leitura; o to_numeric só garante o tipo numérico da coluna
+    df = pd.read_excel(
+        xlsx_path, usecols=COLUNAS_ABANDONO, engine=_engine_excel(), na_values=["--"], decimal=","
+    )
+    df["taxa"] = pd.to_numeric(df.pop("Total Abandono no Ens. Médio"), errors="coerce")
+
+    _gravar_parquet(df, parquet_path)
+    return df
+
+
+def read_municipios(csv_path, parquet_path):
+    """Lê as coordenadas dos municípios"""
+    if _parquet_atualizado(csv_path, parquet_path):
+        return pd.read_parquet(parquet_path, columns=list(TIPOS_MUNICIPIOS))
+
+    df_geo = pd.read_csv(
+        csv_path, encoding="latin1", usecols=list(TIPOS_MUNICIPIOS), dtype=TIPOS_MUNICIPIOS
+    )
+
+    _gravar_parquet(df_geo, parquet_path)
+    return df_geo
@@ -0,0 +1,25 @@
+"""Converte os arquivos de data/ para Parquet, bem mais rápido de carregar no aplicativo.
+
+O aplicativo já grava essas cópias sozinho na primeira execução; o script
+serve para gerá-las antes, por exemplo ao preparar uma implantação.
+
+Uso (na raiz do projeto): python scripts/convert_data.py
+"""
+import sys
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+from parquet_cache import read_abandono, read_municipios  # noqa: E402
+
+DATA_PATH = RAIZ / "data"
+
+
+def main():
+    read_abandono(DATA_PATH / "txabandono-municipios.xlsx", DATA_PATH / "txabandono.parquet")
+    read_municipios(DATA_PATH / "municipios.csv", DATA_PATH / "municipios.parquet")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,7 @@
+import hashlib
 import streamlit as st
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import folium
-from streamlit_folium import st_folium
-from libpysal.weights import Queen
-from esda.moran import Moran_Local
-import tempfile
-import os
-from io import BytesIO
 from pathlib import Path
 
 # Configuração da página
@@ -74,15 +64,46 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Cache para carregamento dos dados
-@st.cache_data
+# Número de vizinhos mais próximos usados na matriz de pesos espaciais
+N_VIZINHOS = 8
+
+# Semente fixa das permutações: mesmos p-valores (e chaves de cache) a cada execução
+SEMENTE_PERMUTACOES = 42
+
+# Versão dos resultados LISA gravados em disco. O Streamlit só considera o
+# código da própria função na chave do cache, então o hash do kernel entra
+# como argumento e muda sozinho quando moran_local_numba.py é alterado;
+# aumente VERSAO_CALCULO ao mudar build_base_and_weights ou outra etapa usada
+# por calculate_lisa_results
+VERSAO_CALCULO = 1
+VERSAO_RESULTADOS = f"{VERSAO_CALCULO}-" + hashlib.sha1(
+    Path(__file__).with_name("moran_local_numba.py").read_bytes()
+).hexdigest()[:12]
+
+# Cores para clusters
+CORES_CLUSTER = {
+    "HH": "#d62728",  # Vermelho
+    "LL": "#1f77b4",  # Azul
+    "LH": "#2ca02c",  # Verde
+    "HL": "#ff7f0e",  # Laranja
+    "ns": "#7f7f7f"   # Cinza
+}
+
+# Cache para carregamento dos dados: os DataFrames só são lidos, então ficam
+# compartilhados por referência em vez de serem copiados a cada execução
+@st.cache_resource
 def load_data():
     """Carrega os dados dos caminhos relativos"""
+    from parquet_cache import read_abandono, read_municipios
+    
     try:
         # Definir caminhos relativos
         base_path = Path(".")  # Diretório atual
         abandono_path = base_path / "data" / "txabandono-municipios.xlsx"
         municipios_path = base_path / "data" / "municipios.csv"
+        # Cópias em Parquet, gravadas na primeira leitura dos originais
+        abandono_parquet = base_path / "data" / "txabandono.parquet"
+        municipios_parquet = base_path / "data" / "municipios.parquet"
         
         # Verificar se os arquivos existem
         if not abandono_path.exists():
@@ -97,22 +118,16 @@ def load_data():
         
         # Carregar dados de abandono
         st.info(f"Dados separados por ano - selecione o ano desejado na barra lateral")
-        df = pd.read_excel(abandono_path)
-        
-        # Processar dados de abandono
-        df["taxa"] = (
-            df["Total Abandono no Ens. Médio"]
-            .astype(str)
-            .str.replace(",", ".", regex=False)
-            .replace("--", np.nan)
-            .pipe(pd.to_numeric, errors="coerce")
-        )
+        df = read_abandono(abandono_path, abandono_parquet)
         df = df.dropna(subset=["taxa"])
-        df["cod_mun"] = df["cod_mun"].astype(int)
+        # A taxa continua em float64: médias e valores exportados ficam iguais
+        # aos da planilha
+        df = df.astype({"cod_mun": "int32", "Ano": "int16", "UF": "category", "Região": "category"})
         
         # Carregar dados geográficos
         st.info(f"Os dados do ano de 2021 não devem ser considerados pela existência de inconsistências devido à pandemia de Covid-19.")
-        df_geo = pd.read_csv(municipios_path, encoding="latin1")
+        df_geo = read_municipios(municipios_path, municipios_parquet)
+        df_geo = df_geo.astype({"longitude": "float32", "latitude": "float32", "cod_mun": "int32"})
         
         return df, df_geo, True
         
@@ -120,146 +135,381 @@ def load_data():
         st.error(f"❌ Erro ao carregar dados: {e}")
         return None, None, False
 
-@st.cache_data
-def calculate_lisa_for_year(df, df_geo, ano):
-    """Calcula estatísticas LISA para um ano específico com cache"""
-    df_geo = df_geo.rename(columns={"cod_mun": "code_muni"})
-    df_geo["code_muni"] = df_geo["code_muni"].astype(int)
+@st.cache_resource
+def build_base_and_weights(df_geo, n_vizinhos=N_VIZINHOS):
+    """Monta a base de municípios e a matriz de vizinhança uma única vez para todos os anos"""
+    from scipy import sparse
+    from scipy.spatial import cKDTree
     
-    # Criar geometria
-    gdf_base = gpd.GeoDataFrame(
-        df_geo,
-        geometry=gpd.points_from_xy(df_geo["longitude"], df_geo["latitude"]),
-        crs="EPSG:4326"
+    # Base com longitude/latitude simples: nenhuma etapa precisa de geometria Shapely
+    df_base = df_geo.rename(columns={"cod_mun": "code_muni"})
+    df_base["code_muni"] = df_base["code_muni"].astype("int32")
+    
+    # Vizinhança pelos n_vizinhos mais próximos (KNN) sobre todos os municípios,
+    # como matriz esparsa binária. A contiguidade Queen não faz sentido para pontos.
+    coords = np.c_[df_base["longitude"].values, df_base["latitude"].values]
+    _, idx = cKDTree(coords).query(coords, k=n_vizinhos + 1)
+    n = len(df_base)
+    w_full = sparse.csr_matrix(
+        (np.ones(n * n_vizinhos), idx[:, 1:].ravel(), np.arange(0, n * n_vizinhos + 1, n_vizinhos)),
+        shape=(n, n)
     )
     
+    # Posição de cada município (pelo código) nas linhas da matriz
+    code_to_idx = pd.Series(np.arange(n), index=df_base["code_muni"].values)
+    
+    return df_base, w_full, code_to_idx
+
+@st.cache_data
+def uf_regiao_por_municipio(df):
+    """UF e Região de cada município, que não mudam de um ano para outro"""
+    return df.groupby("cod_mun", sort=False, as_index=False).agg(
+        UF=("UF", "first"), Região=("Região", "first")
+    )
+
+# Resultados também gravados em disco: sobrevivem ao reinício do aplicativo.
+# Tudo o que altera o resultado fora desta função (conteúdo dos dados,
+# vizinhos, semente, cores, versão do kernel) vem como argumento para fazer
+# parte da chave. Os DataFrames (com "_") ficam fora do hash: o Streamlit só
+# amostra 10 mil linhas de tabelas grandes, e a impressão digital os cobre
+@st.cache_data(persist="disk", max_entries=64)
+def calculate_lisa_results(_df, _df_geo, ano, n_perm, n_vizinhos, semente, cores, versao, impressao):
+    """Calcula estatísticas LISA para um ano específico (sem geometria)"""
+    from scipy import sparse
+    from moran_local_numba import moran_local
+    
+    _, w_full, code_to_idx = build_base_and_weights(_df_geo, n_vizinhos)
+    
     # Filtrar dados do ano
-    df_ano = df[df["Ano"] == ano].copy()
+    df_ano = _df[_df["Ano"] == ano]
     if df_ano.empty:
         return None
         
-    df_ano["taxa"] = df_ano["taxa"].astype(float)
-    df_media = (
-        df_ano.groupby("cod_mun")["taxa"]
-        .mean()
-        .reset_index()
-        .rename(columns={"taxa": "taxa_abandono"})
-    )
+    # Média da taxa por município com somas e contagens via bincount
+    codes, uniques = pd.factorize(df_ano["cod_mun"].values)
+    taxa = df_ano["taxa"].to_numpy(dtype=float)
+    df_media = pd.DataFrame({
+        "cod_mun": uniques,
+        "taxa_abandono": np.bincount(codes, weights=taxa) / np.bincount(codes)
+    })
 
-    gdf = gdf_base.merge(df_media, left_on="code_muni", right_on="cod_mun", how="inner")
+    # Municípios do ano com coordenadas, na ordem da base
+    df_media["pos"] = code_to_idx.reindex(df_media["cod_mun"]).values
+    resultados = (
+        df_media.dropna(subset=["pos"])
+        .astype({"pos": int})
+        .sort_values("pos", ignore_index=True)
+    )
 
-    if gdf.empty:
+    if resultados.empty:
         return None
 
-    # Cálculo LISA
-    w = Queen.from_dataframe(gdf)
-    w.transform = "r"
-    y = gdf["taxa_abandono"].values
-    lisa = Moran_Local(y, w)
-
-    gdf["LISA_I"] = lisa.Is
-    gdf["LISA_p"] = lisa.p_sim
-    gdf["LISA_cluster"] = lisa.q
+    # Cálculo LISA - recorte da vizinhança completa para os municípios do ano,
+    # padronizada por linha
+    pos = resultados["pos"].values
+    w = w_full[pos][:, pos]
+    grau = np.asarray(w.sum(axis=1)).ravel()
+    w = (sparse.diags(1 / np.maximum(grau, 1)) @ w).tocsr()
     
-    # Mapear clusters para rótulos
-    cluster_map = {1: "HH", 2: "LH", 3: "LL", 4: "HL"}
-    gdf["LISA_cluster_label"] = gdf["LISA_cluster"].map(cluster_map)
-    gdf.loc[gdf["LISA_p"] >= 0.05, "LISA_cluster_label"] = "ns"
+    y = resultados["taxa_abandono"].values
+    z = (y - y.mean()) / y.std()
+    Is, p_sim, q = moran_local(z, w.indptr, w.indices, w.data, n_perm, semente)
+
+    # Mapear clusters para rótulos indexando pelo quadrante (1 HH, 2 LH, 3 LL, 4 HL)
+    # direto nos códigos da categoria, sem passar por textos
+    cores = dict(cores)
+    categorias = list(cores)
+    codigo_quadrante = np.array([categorias.index(r) for r in ["ns", "HH", "LH", "LL", "HL"]])
+    codigos = np.where(p_sim < 0.05, codigo_quadrante[q], categorias.index("ns"))
+    rotulos = pd.Categorical.from_codes(codigos, categories=categorias)
+
+    # Todas as colunas de resultado numa única atribuição. Taxa, I e p-valor
+    # ficam em float64, como são exportados; as cores dos mapas já saem
+    # resolvidas por município
+    resultados = resultados.assign(
+        taxa_abandono=y,
+        LISA_I=Is,
+        LISA_p=p_sim,
+        LISA_cluster=q.astype(np.int8),
+        LISA_cluster_label=rotulos,
+        _color=np.array(list(cores.values()))[rotulos.codes],
+        _sig_color=np.where(p_sim < 0.05, "#d62728", "#7f7f7f"),
+    )
 
     # Juntar Região e UF
-    gdf = gdf.merge(df_ano[["cod_mun", "UF", "Região"]].drop_duplicates(),
-                    left_on="code_muni", right_on="cod_mun", how="left")
-
-    return gdf
-
-def create_interactive_map(gdf, ano, map_type="cluster"):
-    """Cria mapa interativo com Folium"""
-    # Cores para clusters
-    cores_cluster = {
-        "HH": "#d62728",  # Vermelho
-        "LL": "#1f77b4",  # Azul
-        "LH": "#2ca02c",  # Verde
-        "HL": "#ff7f0e",  # Laranja
-        "ns": "#7f7f7f"   # Cinza
+    resultados = resultados.merge(uf_regiao_por_municipio(_df), on="cod_mun", how="left")
+
+    return resultados
+
+@st.cache_resource
+def impressao_dados():
+    """Impressão digital do conteúdo completo dos dados carregados, calculada uma única vez"""
+    df, df_geo, _ = load_data()
+    h = hashlib.sha1()
+    for tabela in (df, df_geo):
+        h.update(pd.util.hash_pandas_object(tabela, index=False).to_numpy())
+    return h.hexdigest()
+
+@st.cache_resource
+def calculate_all_years(_df, _df_geo, n_perm, impressao):
+    """Calcula o LISA de todos os anos de uma vez; trocar de ano vira uma consulta ao dicionário"""
+    return {
+        int(ano): calculate_lisa_results(
+            _df, _df_geo, ano, n_perm, N_VIZINHOS, SEMENTE_PERMUTACOES,
+            tuple(CORES_CLUSTER.items()), VERSAO_RESULTADOS, impressao
+        )
+        for ano in sorted(_df["Ano"].unique())
     }
+
+def calculate_lisa_for_year(df, df_geo, ano, n_perm=199):
+    """Junta os resultados LISA do ano (em cache) à base de municípios compartilhada"""
+    resultados = calculate_all_years(df, df_geo, n_perm, impressao_dados()).get(int(ano))
+    if resultados is None:
+        return None
+    
+    df_base, _, _ = build_base_and_weights(df_geo, N_VIZINHOS)
+    gdf = df_base.iloc[resultados["pos"]].reset_index(drop=True)
+    return gdf.join(resultados.drop(columns="pos"))
+
+@st.cache_data
+def summarize(ano, taxa, codigos_cluster):
+    """Resume a taxa de abandono e a distribuição de clusters de um ano com cache"""
+    # Contagem direta dos códigos da categoria (ordem de CORES_CLUSTER), só dos
+    # clusters presentes e do mais para o menos frequente
+    contagens = pd.Series(np.bincount(codigos_cluster, minlength=len(CORES_CLUSTER)), index=list(CORES_CLUSTER))
+    contagens = contagens[contagens > 0].sort_values(ascending=False, kind="stable")
+    return {
+        "mean": taxa.mean(),
+        "median": np.median(taxa),
+        "std": taxa.std(ddof=1),
+        "min": taxa.min(),
+        "max": taxa.max(),
+        "cluster_counts": contagens
+    }
+
+# Colunas exibidas e exportadas na aba de dados detalhados
+COLUNAS_DETALHES = ['municipio', 'UF', 'Região', 'taxa_abandono',
+                    'LISA_cluster_label', 'LISA_I', 'LISA_p']
+
+def filter_details(gdf, cluster_filter, sig_filter):
+    """Aplica os filtros da aba de dados detalhados às colunas exibidas"""
+    colunas_disponiveis = [col for col in COLUNAS_DETALHES if col in gdf.columns]
+
+    # Uma única máscara e uma única cópia, só das colunas exibidas. Os rótulos
+    # são comparados pelos códigos inteiros da categoria, não como texto
+    rotulos = gdf['LISA_cluster_label']
+    codigos = rotulos.cat.categories.get_indexer(list(cluster_filter))
+    mask = np.isin(rotulos.cat.codes.to_numpy(), codigos)
+    p_valores = gdf['LISA_p'].to_numpy()
+    if sig_filter == "Significativos (p < 0.05)":
+        mask = mask & (p_valores < 0.05)
+    elif sig_filter == "Não significativos (p ≥ 0.05)":
+        mask = mask & (p_valores >= 0.05)
+    return gdf.loc[mask, colunas_disponiveis]
+
+@st.cache_data
+def make_csv(ano, n_perm, cluster_filter, sig_filter):
+    """Gera o CSV dos dados filtrados com cache pelo ano e pelos filtros"""
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
     
-    # Criar mapa base centrado no Brasil
-    m = folium.Map(
+    # Refaz o filtro a partir dos resultados em cache em vez de receber
+    # o DataFrame da página, que teria de ser hasheado a cada execução
+    df, df_geo, _ = load_data()
+    gdf = calculate_lisa_for_year(df, df_geo, ano, n_perm)
+    
+    # O escritor CSV do Arrow grava os bytes UTF-8 direto, sem montar a
+    # string inteira em Python
+    tabela = pa.Table.from_pandas(filter_details(gdf, cluster_filter, sig_filter), preserve_index=False)
+    saida = pa.BufferOutputStream()
+    pacsv.write_csv(tabela, saida)
+    return saida.getvalue().to_pybytes()
+
+# Guarda zoom e posição do mapa no sessionStorage do navegador (um registro
+# por tipo de mapa) e os restaura quando o iframe é recriado ao trocar de ano
+VISTA_MAPA_JS = """
+{% macro script(this, kwargs) %}
+(function(mapa, chave) {
+    try {
+        var vista = JSON.parse(sessionStorage.getItem(chave));
+        if (vista) { mapa.setView(vista.centro, vista.zoom); }
+        mapa.on("moveend", function() {
+            sessionStorage.setItem(chave, JSON.stringify({centro: mapa.getCenter(), zoom: mapa.getZoom()}));
+        });
+    } catch (e) {}
+})({{ this._parent.get_name() }}, "lisa_vista_{{ this.map_type }}");
+{% endmacro %}
+"""
+
+def create_base_map(map_type):
+    """Mapa base centrado no Brasil, mantendo o zoom e a posição da sessão"""
+    import folium
+    from branca.element import MacroElement
+    from jinja2 import Template
+    
+    # Os pontos são desenhados em um único canvas em vez de um elemento SVG
+    # por município
+    mapa = folium.Map(
         location=[-14.2350, -51.9253],  # Centro do Brasil
         zoom_start=4,
-        tiles='OpenStreetMap'
+        tiles='OpenStreetMap',
+        prefer_canvas=True
     )
     
-    # Adicionar pontos ao mapa
-    for idx, row in gdf.iterrows():
-        if map_type == "cluster":
-            color = cores_cluster.get(row["LISA_cluster_label"], "#7f7f7f")
-            popup_text = f"""
-            <b>{row.get('municipio', 'N/A')}</b><br>
-            UF: {row.get('UF', 'N/A')}<br>
-            Região: {row.get('Região', 'N/A')}<br>
-            Taxa Abandono: {row['taxa_abandono']:.2f}%<br>
-            Cluster: {row['LISA_cluster_label']}<br>
-            p-valor: {row['LISA_p']:.3f}
-            """
-        else:  # significance
-            color = "#d62728" if row["LISA_p"] < 0.05 else "#7f7f7f"
-            popup_text = f"""
-            <b>{row.get('municipio', 'N/A')}</b><br>
-            UF: {row.get('UF', 'N/A')}<br>
-            Região: {row.get('Região', 'N/A')}<br>
-            Taxa Abandono: {row['taxa_abandono']:.2f}%<br>
-            p-valor: {row['LISA_p']:.3f}<br>
-            Significativo: {'Sim' if row['LISA_p'] < 0.05 else 'Não'}
-            """
-        
-        folium.CircleMarker(
-            location=[row.geometry.y, row.geometry.x],
-            radius=3,
-            popup=popup_text,
-            color=color,
-            fill=True,
-            fillColor=color,
-            fillOpacity=0.7
-        ).add_to(m)
+    vista = MacroElement()
+    vista._template = Template(VISTA_MAPA_JS)
+    vista.map_type = map_type
+    mapa.add_child(vista)
+    return mapa
+
+@st.cache_data
+def render_maps_html(ano, n_perm):
+    """Renderiza o HTML dos mapas de clusters e de significância uma vez por ano"""
+    # Os mapas só são exibidos (nada é lido de volta do navegador), então o
+    # HTML pronto é reaproveitado em vez de remontar o Folium a cada execução
+    df, df_geo, _ = load_data()
+    gdf = calculate_lisa_for_year(df, df_geo, ano, n_perm)
+    htmls = {}
+    for map_type, camada in create_map_layers(gdf, ano).items():
+        mapa = create_base_map(map_type)
+        camada.add_to(mapa)
+        htmls[map_type] = mapa.get_root().render()
+    return htmls
+
+def create_map_layers(gdf, ano):
+    """Cria as camadas de pontos dos mapas de clusters e de significância (Folium) para o ano"""
+    import folium
+    
+    # Textos dos popups montados sobre arrays de cada coluna (uma f-string por
+    # município); valores ausentes viram "N/A" de uma vez por coluna
+    def texto(coluna):
+        if coluna not in gdf.columns:
+            return ["N/A"] * len(gdf)
+        return gdf[coluna].astype(object).fillna("N/A").tolist()
     
-    return m
+    # Parte comum aos dois mapas: coordenadas (5 casas decimais, ~1 m) e
+    # início do popup. Só as cores e o fim do popup mudam entre eles.
+    geometrias = [
+        {"type": "Point", "coordinates": [lon, lat]}
+        for lon, lat in zip(
+            gdf["longitude"].to_numpy(dtype=float).round(5).tolist(),
+            gdf["latitude"].to_numpy(dtype=float).round(5).tolist()
+        )
+    ]
+    popup = [
+        f"<b>{municipio}</b><br>UF: {uf}<br>Região: {regiao}<br>Taxa Abandono: {taxa:.2f}%<br>"
+        for municipio, uf, regiao, taxa in zip(
+            texto("municipio"), texto("UF"), texto("Região"), gdf["taxa_abandono"].tolist()
+        )
+    ]
+    p_valor = [f"{p:.3f}" for p in gdf["LISA_p"].tolist()]
+    rotulos = gdf["LISA_cluster_label"].astype(str).tolist()
+    significativo = (gdf["LISA_p"].to_numpy() < 0.05).tolist()
+    
+    variantes = {
+        "cluster": (
+            gdf["_color"].tolist(),
+            [f"{inicio}Cluster: {rotulo}<br>p-valor: {p}" for inicio, rotulo, p in zip(popup, rotulos, p_valor)]
+        ),
+        "significance": (
+            gdf["_sig_color"].tolist(),
+            [f"{inicio}p-valor: {p}<br>Significativo: {'Sim' if sig else 'Não'}"
+             for inicio, p, sig in zip(popup, p_valor, significativo)]
+        ),
+    }
+    
+    camadas = {}
+    for map_type, (cores, popups) in variantes.items():
+        # Todos os pontos em uma única camada GeoJSON
+        pontos = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "id": str(i),
+                    "geometry": geometria,
+                    "properties": {"popup": texto_popup, "cor": cor}
+                }
+                for i, (geometria, texto_popup, cor) in enumerate(zip(geometrias, popups, cores))
+            ]
+        }
+        fg = folium.FeatureGroup(name=f"lisa_{map_type}_{ano}")
+        folium.GeoJson(
+            pontos,
+            marker=folium.CircleMarker(radius=3, fill=True, fill_opacity=0.7),
+            style_function=lambda feature: {
+                "color": feature["properties"]["cor"],
+                "fillColor": feature["properties"]["cor"]
+            },
+            popup=folium.GeoJsonPopup(fields=["popup"], labels=False)
+        ).add_to(fg)
+        camadas[map_type] = fg
+    
+    return camadas
 
-def create_plotly_charts(gdf):
+def create_plotly_charts(gdf, cluster_counts):
     """Cria gráficos interativos com Plotly"""
-    # Gráfico de barras - distribuição de clusters
-    cluster_counts = gdf['LISA_cluster_label'].value_counts()
+    import plotly.graph_objects as go
     
-    fig_bar = px.bar(
-        x=cluster_counts.index,
-        y=cluster_counts.values,
+    # Gráfico de barras - distribuição de clusters, direto das contagens do
+    # resumo e com a cor de cada barra já resolvida
+    fig_bar = go.Figure(go.Bar(
+        x=cluster_counts.index.to_numpy(),
+        y=cluster_counts.to_numpy(),
+        marker_color=[CORES_CLUSTER[c] for c in cluster_counts.index],
+        hovertemplate="Tipo de Cluster=%{x}<br>Número de Municípios=%{y}<extra></extra>"
+    ))
+    fig_bar.update_layout(
         title="Distribuição de Clusters LISA",
-        labels={'x': 'Tipo de Cluster', 'y': 'Número de Municípios'},
-        color=cluster_counts.index,
-        color_discrete_map={
-            "HH": "#d62728", "LL": "#1f77b4", "LH": "#2ca02c", 
-            "HL": "#ff7f0e", "ns": "#7f7f7f"
-        }
+        xaxis_title='Tipo de Cluster',
+        yaxis_title='Número de Municípios',
+        showlegend=False
     )
-    fig_bar.update_layout(showlegend=False)
     
-    # Histograma das taxas de abandono
-    fig_hist = px.histogram(
-        gdf, 
-        x='taxa_abandono',
+    # Histograma das taxas de abandono: as contagens são calculadas aqui e só
+    # as 30 barras vão para o navegador, em vez de todos os municípios
+    contagens, bordas = np.histogram(gdf['taxa_abandono'].to_numpy(dtype=float), bins=30)
+    fig_hist = go.Figure(go.Bar(
+        x=(bordas[:-1] + bordas[1:]) / 2,
+        y=contagens,
+        width=np.diff(bordas),
+        customdata=np.c_[bordas[:-1], bordas[1:]],
+        hovertemplate="Taxa de Abandono (%)=%{customdata[0]:.2f}-%{customdata[1]:.2f}<br>Frequência=%{y}<extra></extra>"
+    ))
+    fig_hist.update_layout(
         title="Distribuição das Taxas de Abandono",
-        labels={'taxa_abandono': 'Taxa de Abandono (%)', 'count': 'Frequência'},
-        nbins=30
+        xaxis_title='Taxa de Abandono (%)',
+        yaxis_title='Frequência',
+        bargap=0
     )
     
-    # Boxplot por região
+    # Boxplot por região com quartis e limites (1,5 IQR) pré-calculados; só os
+    # valores atípicos seguem como pontos individuais
     if 'Região' in gdf.columns:
-        fig_box = px.box(
-            gdf, 
-            x='Região', 
-            y='taxa_abandono',
+        regioes, quartis, limites, atipicos_x, atipicos_y = [], [], [], [], []
+        for regiao, valores in gdf.groupby('Região', sort=False, observed=True)['taxa_abandono']:
+            v = valores.to_numpy(dtype=float)
+            q1, mediana, q3 = np.quantile(v, [0.25, 0.5, 0.75])
+            dentro = (v >= q1 - 1.5 * (q3 - q1)) & (v <= q3 + 1.5 * (q3 - q1))
+            regioes.append(regiao)
+            quartis.append((q1, mediana, q3))
+            limites.append((v[dentro].min(), v[dentro].max()))
+            atipicos_x.extend([regiao] * int((~dentro).sum()))
+            atipicos_y.extend(v[~dentro].tolist())
+        q1, mediana, q3 = np.array(quartis).T
+        inferior, superior = np.array(limites).T
+        
+        fig_box = go.Figure([
+            go.Box(x=regioes, q1=q1, median=mediana, q3=q3,
+                   lowerfence=inferior, upperfence=superior,
+                   marker_color="#636efa", showlegend=False),
+            go.Scatter(x=atipicos_x, y=atipicos_y, mode="markers",
+                       marker=dict(color="#636efa", size=4), showlegend=False)
+        ])
+        fig_box.update_layout(
             title="Taxa de Abandono por Região",
-            labels={'taxa_abandono': 'Taxa de Abandono (%)', 'Região': 'Região'}
+            xaxis_title='Região',
+            yaxis_title='Taxa de Abandono (%)'
         )
         fig_box.update_xaxes(tickangle=45)
     else:
@@ -267,6 +517,24 @@ def create_plotly_charts(gdf):
     
     return fig_bar, fig_hist, fig_box
 
+@st.cache_data
+def build_charts(ano, n_perm):
+    """Monta os gráficos estatísticos uma vez por ano"""
+    df, df_geo, _ = load_data()
+    gdf = calculate_lisa_for_year(df, df_geo, ano, n_perm)
+    resumo = summarize(ano, gdf["taxa_abandono"].to_numpy(), gdf["LISA_cluster_label"].cat.codes.to_numpy())
+    return create_plotly_charts(gdf, resumo["cluster_counts"])
+
+@st.cache_data
+def info_dados():
+    """Totais e anos disponíveis exibidos na barra lateral, calculados uma única vez"""
+    df, _, _ = load_data()
+    return {
+        "municipios": df["cod_mun"].nunique(),
+        "anos": sorted(df["Ano"].unique()),
+        "registros": len(df),
+    }
+
 # Verificar se os arquivos existem
 base_path = Path(".")
 abandono_path = base_path / "data" / "txabandono-municipios.xlsx"
@@ -289,18 +557,19 @@ if abandono_path.exists() and municipios_path.exists():
 
     if data_loaded and df is not None and df_geo is not None:
         # Sidebar com informações dos dados
+        info = info_dados()
+        anos_disponiveis = info["anos"]
         st.sidebar.header("Informações:")
         st.sidebar.success(f"""
         **Dados disponíveis**
         
-        **Municípios:** {len(df['cod_mun'].unique())}  
-        **Anos disponíveis:** {len(df['Ano'].unique())}  
-        **Total de registros:** {len(df)}
-        **Período:** {df['Ano'].min()} - {df['Ano'].max()}
+        **Municípios:** {info['municipios']}  
+        **Anos disponíveis:** {len(anos_disponiveis)}  
+        **Total de registros:** {info['registros']}
+        **Período:** {anos_disponiveis[0]} - {anos_disponiveis[-1]}
         """)
         
         # Mostrar anos disponíveis
-        anos_disponiveis = sorted(df['Ano'].unique())
         st.sidebar.info(f"**Anos disponíveis:** {', '.join(map(str, anos_disponiveis))}")
         
         # Seleção de ano - PRINCIPAL CONTROLE
@@ -311,7 +580,12 @@ if abandono_path.exists() and municipios_path.exists():
             index=len(anos_disponiveis)-1,  # Último ano por padrão
             help="Escolha o ano - exceto 2021"
         )
-        
+        n_perm = st.sidebar.slider(
+            "Permutações",
+            99, 999, 199, step=100,
+            help="Número de permutações do teste de significância do LISA (199 já dá resolução de 0,005 para o p-valor)"
+        )
+
         # Opções de visualização
         st.sidebar.header("Opções de Visualização")
         mostrar_mapas = st.sidebar.checkbox("Mapas interativos", value=True)
@@ -320,9 +594,15 @@ if abandono_path.exists() and municipios_path.exists():
         
         # Calcular LISA para o ano selecionado
         with st.spinner(f"🧮 Calculando estatísticas LISA para {ano_selecionado}..."):
-            gdf = calculate_lisa_for_year(df, df_geo, ano_selecionado)
+            gdf = calculate_lisa_for_year(df, df_geo, ano_selecionado, n_perm)
         
         if gdf is not None:
+            resumo = summarize(
+                ano_selecionado,
+                gdf["taxa_abandono"].to_numpy(),
+                gdf["LISA_cluster_label"].cat.codes.to_numpy()
+            )
+            
             # Métricas principais
             st.subheader(f"Resultados da Análise LISA - {ano_selecionado}")
             
@@ -338,8 +618,7 @@ if abandono_path.exists() and municipios_path.exists():
                 st.metric("✅ Clusters Significativos", f"{significativos} ({percentual_sig:.1f}%)")
             
             with col3:
-                taxa_media = gdf['taxa_abandono'].mean()
-                st.metric("📈 Taxa Média de Abandono", f"{taxa_media:.2f}%")
+                st.metric("📈 Taxa Média de Abandono", f"{resumo['mean']:.2f}%")
             
             with col4:
                 moran_i = gdf['LISA_I'].mean()
@@ -359,11 +638,12 @@ if abandono_path.exists() and municipios_path.exists():
                 tab_index = 0
                 
                 if mostrar_mapas:
+                    mapas_html = render_maps_html(ano_selecionado, n_perm)
+                    
                     # Tab Mapa de Clusters
                     with tabs[tab_index]:
                         st.subheader(f"Mapa LISA - Clusters - {ano_selecionado}")
-                        mapa_cluster = create_interactive_map(gdf, ano_selecionado, "cluster")
-                        st_folium(mapa_cluster, width=700, height=500)
+                        st.iframe(mapas_html["cluster"], width=700, height=510)
                         
                         # Legenda
                         st.markdown("""
@@ -379,8 +659,7 @@ if abandono_path.exists() and municipios_path.exists():
                     # Tab Mapa de Significância
                     with tabs[tab_index]:
                         st.subheader(f"Mapa LISA - Significância Estatística - {ano_selecionado}")
-                        mapa_sig = create_interactive_map(gdf, ano_selecionado, "significance")
-                        st_folium(mapa_sig, width=700, height=500)
+                        st.iframe(mapas_html["significance"], width=700, height=510)
                         
                         st.markdown("""
                         **Legenda da Significância:**
@@ -394,7 +673,7 @@ if abandono_path.exists() and municipios_path.exists():
                     with tabs[tab_index]:
                         st.subheader("Análise Estatística")
                         
-                        fig_bar, fig_hist, fig_box = create_plotly_charts(gdf)
+                        fig_bar, fig_hist, fig_box = build_charts(ano_selecionado, n_perm)
                         
                         col1, col2 = st.columns(2)
                         with col1:
@@ -414,10 +693,12 @@ if abandono_path.exists() and municipios_path.exists():
                         # Filtros para os dados
                         col1, col2 = st.columns(2)
                         with col1:
+                            # Clusters presentes no ano, já contados no resumo
+                            opcoes_cluster = list(resumo["cluster_counts"].index)
                             cluster_filter = st.multiselect(
                                 "Filtrar por tipo de cluster:",
-                                options=gdf['LISA_cluster_label'].unique(),
-                                default=gdf['LISA_cluster_label'].unique()
+                                options=opcoes_cluster,
+                                default=opcoes_cluster
                             )
                         with col2:
                             sig_filter = st.selectbox(
@@ -426,28 +707,16 @@ if abandono_path.exists() and municipios_path.exists():
                             )
                         
                         # Aplicar filtros
-                        gdf_filtered = gdf[gdf['LISA_cluster_label'].isin(cluster_filter)]
-                        if sig_filter == "Significativos (p < 0.05)":
-                            gdf_filtered = gdf_filtered[gdf_filtered['LISA_p'] < 0.05]
-                        elif sig_filter == "Não significativos (p ≥ 0.05)":
-                            gdf_filtered = gdf_filtered[gdf_filtered['LISA_p'] >= 0.05]
-                        
+                        gdf_filtered = filter_details(gdf, cluster_filter, sig_filter)
+
                         # Mostrar dados
-                        colunas_mostrar = ['municipio', 'UF', 'Região', 'taxa_abandono', 
-                                         'LISA_cluster_label', 'LISA_I', 'LISA_p']
-                        colunas_disponiveis = [col for col in colunas_mostrar if col in gdf_filtered.columns]
-                        
                         st.dataframe(
-                            gdf_filtered[colunas_disponiveis].round(3),
+                            gdf_filtered.round(3),
                             use_container_width=True
                         )
                         
                         # Download dos dados
-                        @st.cache_data
-                        def convert_df_to_csv(df):
-                            return df.to_csv(index=False).encode('utf-8')
-                        
-                        csv_data = convert_df_to_csv(gdf_filtered[colunas_disponiveis])
+                        csv_data = make_csv(ano_selecionado, n_perm, tuple(cluster_filter), sig_filter)
                         st.download_button(
                             label="📥 Baixar dados filtrados (CSV)",
                             data=csv_data,
@@ -462,18 +731,19 @@ if abandono_path.exists() and municipios_path.exists():
             
             with col1:
                 st.write("**Distribuição de Clusters:**")
-                cluster_summary = gdf['LISA_cluster_label'].value_counts()
-                for cluster, count in cluster_summary.items():
-                    percentage = (count / len(gdf)) * 100
-                    st.write(f"- **{cluster}**: {count} municípios ({percentage:.1f}%)")
+                # Lista inteira num único elemento da página
+                st.markdown("\n".join(
+                    f"- **{cluster}**: {count} municípios ({count / len(gdf) * 100:.1f}%)"
+                    for cluster, count in resumo["cluster_counts"].items()
+                ))
             
             with col2:
                 st.write("**Estatísticas da Taxa de Abandono:**")
-                st.write(f"- **Média**: {gdf['taxa_abandono'].mean():.2f}%")
-                st.write(f"- **Mediana**: {gdf['taxa_abandono'].median():.2f}%")
-                st.write(f"- **Desvio padrão**: {gdf['taxa_abandono'].std():.2f}%")
-                st.write(f"- **Mínimo**: {gdf['taxa_abandono'].min():.2f}%")
-                st.write(f"- **Máximo**: {gdf['taxa_abandono'].max():.2f}%")
+                st.write(f"- **Média**: {resumo['mean']:.2f}%")
+                st.write(f"- **Mediana**: {resumo['median']:.2f}%")
+                st.write(f"- **Desvio padrão**: {resumo['std']:.2f}%")
+                st.write(f"- **Mínimo**: {resumo['min']:.2f}%")
+                st.write(f"- **Máximo**: {resumo['max']:.2f}%")
         
         else:
             st.error(f"❌ Não foi possível calcular as estatísticas LISA para o ano {ano_selecionado}. Verifique se há dados disponíveis para este ano.")
@@ -507,7 +777,7 @@ else:
     
     1. **Instale as dependências:**
     ```bash
-    pip install streamlit pandas numpy geopandas plotly folium streamlit-folium libpysal esda openpyxl
+    pip install streamlit pandas numpy scipy numba plotly folium openpyxl python-calamine pyarrow
     ```
     
     2. **Execute o aplicativo:**